@@ -0,0 +1,166 @@
+"""Сравнение фиксированного и адаптивного качества JPEG.
+
+Для синтетических страниц (текст, фотография, текст с фотографией, мелкая
+текстура) в каждом режиме сжатия кодирует страницу с фиксированным quality
+и с качеством, выбранным select_jpeg_quality, и выводит размер и SSIM на
+полном разрешении:
+
+    python bench_quality.py
+    python bench_quality.py --output bench_quality.json
+
+Перед замерами проверяется корректность ssim(). Скрипт завершается с кодом 1,
+если адаптивный режим увеличил суммарный размер страниц или снизил SSIM
+какой-либо страницы больше, чем на --max-ssim-drop.
+
+Обоснование порогов в COMPRESSION_SETTINGS (замер на этих страницах):
+ssim_tolerance 0.01/0.005/0.0025 для strong/medium/weak дает 68-94% размера
+фиксированного режима на страницах, проходящих ssim_floor, при снижении SSIM
+на полном разрешении не больше 0.018/0.010/0.005. ssim_floor 0.93/0.94/0.95
+отделяет текстуру (SSIM уменьшенной копии 0.87/0.91 при quality в strong и
+medium) от текста и фотографий: текстура получает quality 45/65 (max_quality)
+и SSIM 0.896/0.957 вместо 0.856/0.938 ценой 150%/133% размера. В weak
+текстура проходит порог без повышения. В сумме адаптивный режим дает 95%
+размера фиксированного.
+"""
+import io
+import sys
+import json
+import argparse
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from quality import ssim, make_proxy, jpeg_ssim, select_jpeg_quality
+from worker import COMPRESSION_SETTINGS, ADAPTIVE_MAX_TRIALS, ADAPTIVE_PROXY_SIZE
+
+
+# Страницы генерируются при 150 dpi (A4) и масштабируются под dpi режима
+BASE_DPI = 150
+BASE_SIZE = (1240, 1754)
+
+
+def text_page():
+    img = Image.new("RGB", BASE_SIZE, "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(80, 1680, 22):
+        draw.text((80, y), "Lorem ipsum dolor sit amet, consectetur adipiscing elit sed do " * 2, fill="black")
+    return img
+
+
+def photo_page():
+    rng = np.random.default_rng(1)
+    x = np.linspace(0, 6, BASE_SIZE[0])
+    y = np.linspace(0, 9, BASE_SIZE[1])
+    base = np.stack([np.sin(x)[None, :] * np.cos(y)[:, None] * 90 + 128 + c * 20 for c in range(3)], -1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(1))
+
+
+def mixed_page():
+    img = text_page()
+    img.paste(photo_page().crop((0, 0, 1000, 600)), (120, 1000))
+    return img
+
+
+def texture_page():
+    """Фотография с мелкими деталями (листва, ткань), теряющая вид при низком quality"""
+    rng = np.random.default_rng(2)
+    pixels = np.clip(rng.normal(128, 40, (BASE_SIZE[1], BASE_SIZE[0], 3)), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(1.5))
+
+
+PAGES = {"text": text_page, "photo": photo_page, "mixed": mixed_page, "texture": texture_page}
+
+
+def encode(img, quality):
+    """Размер JPEG и SSIM на полном разрешении"""
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    size = buf.tell()
+    buf.seek(0)
+    decoded = np.asarray(Image.open(buf).convert("L"))
+    return size, ssim(np.asarray(img.convert("L")), decoded)
+
+
+def sanity_checks():
+    """Проверки ssim(); возвращает список ошибок"""
+    errors = []
+    page = text_page()
+    a = np.asarray(page.convert("L"))
+    if abs(ssim(a, a) - 1.0) > 1e-9:
+        errors.append("ssim of identical images is not 1")
+
+    noisy = np.clip(a + np.random.default_rng(0).normal(0, 20, a.shape), 0, 255)
+    if abs(ssim(a, noisy) - ssim(noisy, a)) > 1e-9:
+        errors.append("ssim is not symmetric")
+    if not 0 < ssim(a, noisy) < 1:
+        errors.append("ssim of noisy image is out of (0, 1)")
+
+    proxy = make_proxy(photo_page(), ADAPTIVE_PROXY_SIZE)
+    reference = np.asarray(proxy.convert("L"))
+    scores = [jpeg_ssim(proxy, reference, q) for q in (20, 40, 60, 80, 95)]
+    if scores != sorted(scores):
+        errors.append(f"ssim does not grow with JPEG quality: {scores}")
+    return errors
+
+
+def run(max_ssim_drop):
+    report = {}
+    errors = []
+    print(f"{'page':<7} {'mode':<7} {'fixed q':>7} {'bytes':>8} {'ssim':>6}   "
+          f"{'adapt q':>7} {'bytes':>8} {'ssim':>6}   {'size':>6}")
+    totals = {"fixed": 0, "adaptive": 0}
+    for mode, settings in COMPRESSION_SETTINGS.items():
+        scale = settings["dpi"] / BASE_DPI
+        for name, make_page in PAGES.items():
+            page = make_page().resize((int(BASE_SIZE[0] * scale), int(BASE_SIZE[1] * scale)))
+            fixed_size, fixed_ssim = encode(page, settings["quality"])
+            quality = select_jpeg_quality(
+                page, settings["quality"], settings["min_quality"], settings["max_quality"],
+                settings["ssim_tolerance"], settings["ssim_floor"],
+                max_trials=ADAPTIVE_MAX_TRIALS, proxy_size=ADAPTIVE_PROXY_SIZE
+            )
+            adaptive_size, adaptive_ssim = encode(page, quality)
+            totals["fixed"] += fixed_size
+            totals["adaptive"] += adaptive_size
+
+            report[f"{mode}/{name}"] = {
+                "fixed": {"quality": settings["quality"], "bytes": fixed_size, "ssim": fixed_ssim},
+                "adaptive": {"quality": quality, "bytes": adaptive_size, "ssim": adaptive_ssim},
+            }
+            print(f"{name:<7} {mode:<7} {settings['quality']:>7} {fixed_size:>8} {fixed_ssim:6.3f}   "
+                  f"{quality:>7} {adaptive_size:>8} {adaptive_ssim:6.3f}   {adaptive_size / fixed_size:6.0%}")
+
+            if fixed_ssim - adaptive_ssim > max_ssim_drop:
+                errors.append(f"{mode}/{name}: SSIM dropped by {fixed_ssim - adaptive_ssim:.4f}")
+
+    # Отдельные страницы могут вырасти, если их качество повышено до ssim_floor
+    if totals["adaptive"] > totals["fixed"]:
+        errors.append(f"adaptive total is larger ({totals['adaptive']} > {totals['fixed']})")
+    print(f"total   fixed {totals['fixed']} bytes, adaptive {totals['adaptive']} bytes "
+          f"({totals['adaptive'] / totals['fixed']:.0%})")
+    report["total"] = totals
+    return report, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-ssim-drop", type=float, default=0.02,
+                        help="Допустимое снижение SSIM на полном разрешении")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    errors = sanity_checks()
+    report, bench_errors = run(args.max_ssim_drop)
+    errors += bench_errors
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for error in errors:
+        print(f"FAIL: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
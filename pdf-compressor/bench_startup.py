@@ -0,0 +1,67 @@
+"""Замер холодного старта модулей воркера и веб-приложения.
+
+Каждый замер выполняется в отдельном процессе интерпретатора, чтобы
+кеш импортов не искажал результат:
+
+    python bench_startup.py --runs 10
+    python bench_startup.py --modules worker --output bench_startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+SNIPPET = (
+    "import time\n"
+    "t = time.perf_counter()\n"
+    "import {module}\n"
+    "print(time.perf_counter() - t)\n"
+)
+
+
+def measure(module, runs):
+    """Время импорта модуля в новом процессе, секунды на каждый запуск"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(module=module)],
+            cwd=here,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Количество запусков на модуль")
+    parser.add_argument("--modules", nargs="+", default=["worker", "app"], help="Модули для замера")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    report = {}
+    for module in args.modules:
+        timings = measure(module, args.runs)
+        report[module] = {
+            "runs": args.runs,
+            "min_ms": min(timings) * 1000,
+            "median_ms": statistics.median(timings) * 1000,
+            "max_ms": max(timings) * 1000,
+        }
+        print(f"{module:<10} min {report[module]['min_ms']:8.1f} ms   "
+              f"median {report[module]['median_ms']:8.1f} ms   "
+              f"max {report[module]['max_ms']:8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
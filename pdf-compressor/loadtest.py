@@ -0,0 +1,509 @@
+"""Нагрузочное тестирование сценария /compress -> /status -> /download.
+
+Два режима работы:
+
+    # Все в одном процессе: брокер memory://, результаты в cache+memory://,
+    # сессии и планировщик в fakeredis, MinIO заменен хранилищем в памяти.
+    # Воркер Celery запускается в потоках этого же процесса (нужен poppler
+    # для pdf2image).
+    python loadtest.py --users 8 --jobs 40 --workers 4 --mix 1:50,10:35,50:15
+
+    # Против развернутого стенда (например, docker-compose up)
+    python loadtest.py --url http://localhost:5005 --users 8 --jobs 40
+
+Результаты сохраняются в JSON (--output). Каждый прогон сравнивается
+с эталонным loadtest-baseline.json рядом со скриптом (другой файл задается
+через --baseline), и при ухудшении больше --tolerance скрипт завершается
+с кодом 1. Сравнение выполняется, только если параметры прогонов совпадают.
+Эталон обновляется прогоном в процессе с параметрами по умолчанию:
+
+    python loadtest.py --update-baseline
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import queue
+import random
+import argparse
+import platform
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+
+ENDPOINTS = ("compress", "status", "download")
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest-baseline.json")
+
+
+class InMemoryObjectStore:
+    """Замена клиента MinIO, хранящая объекты в памяти процесса"""
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _missing(self, bucket_name, object_name):
+        from minio.error import S3Error
+        return S3Error(None, "NoSuchKey", "Object does not exist", object_name, None, None,
+                       bucket_name=bucket_name, object_name=object_name)
+
+    def _get(self, bucket_name, object_name):
+        with self._lock:
+            if object_name not in self._objects:
+                raise self._missing(bucket_name, object_name)
+            return self._objects[object_name]
+
+    def bucket_exists(self, bucket_name):
+        return True
+
+    def make_bucket(self, bucket_name):
+        pass
+
+    def fput_object(self, bucket_name, object_name, file_path, **kwargs):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self._objects[object_name] = data
+
+    def put_object(self, bucket_name, object_name, data, length, **kwargs):
+        payload = data.read(length)
+        with self._lock:
+            self._objects[object_name] = payload
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        data = self._get(bucket_name, object_name)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+    def get_object(self, bucket_name, object_name, **kwargs):
+        response = io.BytesIO(self._get(bucket_name, object_name))
+        response.release_conn = lambda: None
+        return response
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        from types import SimpleNamespace
+        return SimpleNamespace(object_name=object_name, size=len(self._get(bucket_name, object_name)))
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, **kwargs):
+        from types import SimpleNamespace
+        with self._lock:
+            names = [name for name in self._objects if name.startswith(prefix or "")]
+        return [SimpleNamespace(object_name=name) for name in names]
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        with self._lock:
+            self._objects.pop(object_name, None)
+
+
+class FlaskClient:
+    """Клиент для приложения в этом же процессе; у каждого клиента своя сессия"""
+
+    def __init__(self, flask_app):
+        self._client = flask_app.test_client()
+
+    def post_pdf(self, data, filename, compression_mode):
+        response = self._client.post("/compress", data={
+            "pdf": (io.BytesIO(data), filename),
+            "compression_mode": compression_mode,
+        }, content_type="multipart/form-data")
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def get(self, path):
+        response = self._client.get(path)
+        return response.status_code, response.data
+
+
+class HttpClient:
+    """HTTP клиент для развернутого стенда с собственными cookies"""
+
+    def __init__(self, base_url, timeout=60):
+        self._base_url = base_url.rstrip("/")
+        self._timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def _open(self, req):
+        try:
+            with self._opener.open(req, timeout=self._timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post_pdf(self, data, filename, compression_mode):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="compression_mode"\r\n\r\n'
+            f"{compression_mode}\r\n"
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="pdf"; filename="{filename}"\r\n'
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        req = urllib.request.Request(
+            self._base_url + "/compress",
+            data=body,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            method="POST"
+        )
+        status, payload = self._open(req)
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, {}
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self._base_url + path))
+
+
+def make_pdf(pages, seed=0):
+    """Синтетический PDF: текстовые страницы с фотографической вставкой"""
+    import img2pdf
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for page in range(pages):
+        img = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(img)
+        for y in range(80, 1100, 22):
+            words = " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet", "elit")) for _ in range(18))
+            draw.text((80, y), words, fill="black")
+        photo = Image.effect_noise((900, 500), 40 + page % 40).convert("RGB")
+        img.paste(photo, (170, 1160))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        images.append(buf.getvalue())
+    return img2pdf.convert(images)
+
+
+def parse_mix(spec):
+    """Разбор смеси размеров вида "1:50,10:35,50:15" (страниц:вес)"""
+    mix = []
+    for item in spec.split(","):
+        pages, weight = item.split(":")
+        mix.append((int(pages), float(weight)))
+    return mix
+
+
+def percentile(values, pct):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values, scale=1.0):
+    """p50/p95/p99 и среднее для списка длительностей"""
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "mean": None}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50) * scale,
+        "p95": percentile(values, 95) * scale,
+        "p99": percentile(values, 99) * scale,
+        "mean": sum(values) / len(values) * scale,
+    }
+
+
+class Recorder:
+    """Потокобезопасный сбор замеров"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.queue_wait = []
+        self.job_latency = []
+        self.jobs = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+
+    def request(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latency[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def job(self, outcome, queue_wait=None, latency=None):
+        with self._lock:
+            self.jobs[outcome] += 1
+            if queue_wait is not None:
+                self.queue_wait.append(queue_wait)
+            if latency is not None:
+                self.job_latency.append(latency)
+
+    def submitted(self):
+        with self._lock:
+            self.jobs["submitted"] += 1
+
+
+def timed(recorder, endpoint, call, *args):
+    start = time.perf_counter()
+    status, payload = call(*args)
+    recorder.request(endpoint, time.perf_counter() - start, 200 <= status < 300)
+    return status, payload
+
+
+def run_job(client, recorder, job, args):
+    """Один проход /compress -> /status (до завершения) -> /download"""
+    pages, data = job
+    filename = f"load_{pages}p.pdf"
+
+    status, payload = timed(recorder, "compress", client.post_pdf, data, filename, args.compression_mode)
+    if status != 202:
+        recorder.job("rejected")
+        return
+    recorder.submitted()
+    submitted_at = time.perf_counter()
+    task_id = payload["task_id"]
+    session_id = payload["session_id"]
+
+    queue_wait = None
+    deadline = submitted_at + args.job_timeout
+    while True:
+        status, body = timed(recorder, "status", client.get, f"/status/{task_id}")
+        info = json.loads(body) if status == 200 else {}
+        state = info.get("state")
+        # Ожидание в очереди заканчивается, когда воркер взял задачу (STARTED
+        # при task_track_started) или начал сообщать прогресс. Если задача успела
+        # завершиться между опросами, берется момент первого финального статуса.
+        if state in ("STARTED", "PROGRESS", "SUCCESS", "FAILURE") and queue_wait is None:
+            queue_wait = time.perf_counter() - submitted_at
+        if state == "SUCCESS":
+            break
+        # RETRY и прочие промежуточные состояния не финальные, продолжаем опрос
+        if state == "FAILURE":
+            recorder.job("failed", queue_wait, time.perf_counter() - submitted_at)
+            return
+        if time.perf_counter() > deadline:
+            recorder.job("timed_out", queue_wait)
+            return
+        time.sleep(args.poll_interval)
+
+    if info.get("result", {}).get("status") != "SUCCESS":
+        recorder.job("failed", queue_wait, time.perf_counter() - submitted_at)
+        return
+
+    status, _ = timed(recorder, "download", client.get, f"/download/{session_id}/{filename}?task_id={task_id}")
+    recorder.job("completed" if status == 200 else "failed", queue_wait, time.perf_counter() - submitted_at)
+
+
+def run_load(client_factory, args):
+    """Запуск нагрузки: args.users пользователей разбирают очередь из args.jobs заданий"""
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    documents = {pages: make_pdf(pages, seed=pages) for pages, _ in mix}
+
+    jobs = queue.Queue()
+    for _ in range(args.jobs):
+        pages = rng.choices([p for p, _ in mix], weights=[w for _, w in mix])[0]
+        jobs.put((pages, documents[pages]))
+
+    recorder = Recorder()
+
+    def user():
+        client = client_factory()
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                run_job(client, recorder, job, args)
+            except Exception as e:
+                print(f"job error: {e}", file=sys.stderr)
+                recorder.job("failed")
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(args.users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    endpoints = {}
+    for name in ENDPOINTS:
+        stats = summarize(recorder.latency[name], scale=1000)
+        endpoints[name] = {
+            "count": stats["count"],
+            "errors": recorder.errors[name],
+            "error_rate": recorder.errors[name] / stats["count"] if stats["count"] else 0.0,
+            "p50_ms": stats["p50"],
+            "p95_ms": stats["p95"],
+            "p99_ms": stats["p99"],
+        }
+
+    finished = recorder.jobs["completed"] + recorder.jobs["failed"] + recorder.jobs["timed_out"]
+    return {
+        "config": {
+            "target": args.url or "in-process",
+            "users": args.users,
+            "jobs": args.jobs,
+            "workers": args.workers,
+            "mix": args.mix,
+            "compression_mode": args.compression_mode,
+            "seed": args.seed,
+        },
+        # Для сведения: задержки сравнимы только на похожем железе
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "started_at": started_at,
+        "duration_s": duration,
+        "jobs": dict(
+            recorder.jobs,
+            throughput_jobs_per_s=recorder.jobs["completed"] / duration if duration else 0.0,
+            error_rate=(finished - recorder.jobs["completed"]) / finished if finished else 0.0,
+        ),
+        "queue_wait_s": summarize(recorder.queue_wait),
+        "job_latency_s": summarize(recorder.job_latency),
+        "endpoints": endpoints,
+    }
+
+
+def setup_in_process(args):
+    """Подготовка заменителей брокера, бекенда результатов, Redis и MinIO.
+
+    Возвращает фабрику клиентов и функцию остановки воркера.
+    """
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+
+    import fakeredis
+    from flask_session import Session
+    from celery.contrib.testing.worker import start_worker
+
+    import worker
+    import scheduler
+    import app as web
+
+    worker._minio_client = InMemoryObjectStore()
+    worker._minio_bucket_ready = True
+
+    redis_client = fakeredis.FakeRedis()
+    web.app.config["SESSION_REDIS"] = redis_client
+    Session(web.app)
+    scheduler._redis_client = redis_client
+    scheduler.SCHEDULER_MAX_INFLIGHT = args.workers
+
+    context = start_worker(
+        worker.celery,
+        pool="threads",
+        concurrency=args.workers,
+        perform_ping_check=False,
+        shutdown_timeout=args.job_timeout
+    )
+    context.__enter__()
+    return (lambda: FlaskClient(web.app)), (lambda: context.__exit__(None, None, None))
+
+
+def compare(report, baseline, tolerance):
+    """Сравнение с базовым прогоном; возвращает список ухудшений"""
+    regressions = []
+    if report["config"] != baseline["config"]:
+        print("Baseline was recorded with different parameters, comparison skipped:")
+        for key in sorted(set(report["config"]) | set(baseline["config"])):
+            if report["config"].get(key) != baseline["config"].get(key):
+                print(f"  {key}: baseline {baseline['config'].get(key)!r}, current {report['config'].get(key)!r}")
+        return regressions
+
+    def check(name, current, previous, higher_is_worse=True):
+        if current is None or not previous:
+            return
+        change = (current - previous) / previous
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        mark = "REGRESSION" if worse else "ok"
+        print(f"  {name:<32} {previous:10.2f} -> {current:10.2f}  ({change:+.0%})  {mark}")
+        if worse:
+            regressions.append(name)
+
+    print("Comparison with baseline:")
+    for endpoint in ENDPOINTS:
+        check(f"{endpoint} p95 ms", report["endpoints"][endpoint]["p95_ms"],
+              baseline["endpoints"][endpoint]["p95_ms"])
+    check("job latency p95 s", report["job_latency_s"]["p95"], baseline["job_latency_s"]["p95"])
+    check("queue wait p95 s", report["queue_wait_s"]["p95"], baseline["queue_wait_s"]["p95"])
+    check("throughput jobs/s", report["jobs"]["throughput_jobs_per_s"],
+          baseline["jobs"]["throughput_jobs_per_s"], higher_is_worse=False)
+    if report["jobs"]["error_rate"] > baseline["jobs"]["error_rate"]:
+        print(f"  job error rate {baseline['jobs']['error_rate']:.1%} -> {report['jobs']['error_rate']:.1%}  REGRESSION")
+        regressions.append("job error rate")
+    return regressions
+
+
+def print_report(report):
+    jobs = report["jobs"]
+    print(f"Target: {report['config']['target']}, users: {report['config']['users']}, "
+          f"duration: {report['duration_s']:.1f} s")
+    print(f"Jobs: {jobs['completed']} completed, {jobs['failed']} failed, {jobs['timed_out']} timed out, "
+          f"{jobs['rejected']} rejected; throughput {jobs['throughput_jobs_per_s']:.2f} jobs/s, "
+          f"error rate {jobs['error_rate']:.1%}")
+    for name in ("queue_wait_s", "job_latency_s"):
+        stats = report[name]
+        if stats["count"]:
+            print(f"{name:<16} p50 {stats['p50']:8.2f}  p95 {stats['p95']:8.2f}  p99 {stats['p99']:8.2f}")
+    for name, stats in report["endpoints"].items():
+        if stats["count"]:
+            print(f"/{name:<15} p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  p99 {stats['p99_ms']:8.1f} ms"
+                  f"  errors {stats['errors']}/{stats['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Адрес развернутого приложения; без него все запускается в процессе")
+    parser.add_argument("--users", type=int, default=4, help="Количество параллельных пользователей (сессий)")
+    parser.add_argument("--jobs", type=int, default=20, help="Общее количество заданий")
+    parser.add_argument("--workers", type=int, default=4, help="Потоки воркера Celery в режиме без --url")
+    parser.add_argument("--mix", default="1:50,10:35,50:15", help="Смесь размеров, страниц:вес через запятую")
+    parser.add_argument("--compression-mode", default="medium", help="Режим сжатия")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Интервал опроса /status, секунды")
+    parser.add_argument("--job-timeout", type=float, default=600, help="Максимальное время задания, секунды")
+    parser.add_argument("--seed", type=int, default=0, help="Seed для выбора размеров")
+    parser.add_argument("--output", default="loadtest-results.json", help="Файл для сохранения результатов")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Эталонный прогон для сравнения")
+    parser.add_argument("--update-baseline", action="store_true", help="Записать прогон как эталон в --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно baseline")
+    args = parser.parse_args()
+
+    if args.url:
+        client_factory, shutdown = (lambda: HttpClient(args.url, timeout=args.job_timeout)), (lambda: None)
+    else:
+        client_factory, shutdown = setup_in_process(args)
+
+    try:
+        report = run_load(client_factory, args)
+    finally:
+        shutdown()
+
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline}, comparison skipped")
+
+
+if __name__ == "__main__":
+    main()
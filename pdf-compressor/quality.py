@@ -0,0 +1,89 @@
+import io
+import numpy as np
+from PIL import Image
+
+
+# Подбор качества JPEG для страницы по SSIM.
+# Оценка выполняется на уменьшенной копии страницы (proxy), поэтому
+# каждая пробная итерация кодирования стоит малую долю полного сохранения.
+
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def _box_mean(a, win):
+    """Среднее по всем окнам win x win через интегральное изображение"""
+    c = np.cumsum(np.cumsum(a, axis=0), axis=1)
+    c = np.pad(c, ((1, 0), (1, 0)))
+    s = c[win:, win:] - c[:-win, win:] - c[win:, :-win] + c[:-win, :-win]
+    return s / (win * win)
+
+
+def ssim(a, b, win=SSIM_WINDOW):
+    """Средний SSIM двух полутоновых изображений одинакового размера"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    win = min(win, *a.shape)
+
+    mu_a = _box_mean(a, win)
+    mu_b = _box_mean(b, win)
+    var_a = _box_mean(a * a, win) - mu_a * mu_a
+    var_b = _box_mean(b * b, win) - mu_b * mu_b
+    cov = _box_mean(a * b, win) - mu_a * mu_b
+
+    num = (2 * mu_a * mu_b + SSIM_C1) * (2 * cov + SSIM_C2)
+    den = (mu_a * mu_a + mu_b * mu_b + SSIM_C1) * (var_a + var_b + SSIM_C2)
+    return float(np.mean(num / den))
+
+
+def make_proxy(img, proxy_size):
+    """Уменьшенная RGB копия страницы для пробного кодирования"""
+    proxy = img.convert("RGB")
+    proxy.thumbnail((proxy_size, proxy_size), Image.BILINEAR)
+    return proxy
+
+
+def jpeg_ssim(proxy, reference, quality):
+    """SSIM между proxy и его копией, закодированной в JPEG с заданным качеством"""
+    buf = io.BytesIO()
+    proxy.save(buf, "JPEG", quality=quality)
+    buf.seek(0)
+    decoded = np.asarray(Image.open(buf).convert("L"))
+    return ssim(reference, decoded)
+
+
+def select_jpeg_quality(img, quality, min_quality, max_quality, tolerance, ssim_floor,
+                        max_trials=5, proxy_size=768):
+    """Минимальное качество JPEG, при котором страница выглядит приемлемо.
+
+    Сначала страница кодируется с качеством режима quality. Если ее SSIM
+    не ниже ssim_floor, качество снижается в пределах [min_quality, quality],
+    пока SSIM не ниже max(SSIM при quality - tolerance, ssim_floor), и страница
+    не становится больше, чем при фиксированном качестве. Если SSIM ниже
+    ssim_floor (фотографии с мелкими деталями), качество повышается до
+    минимального, достигающего ssim_floor, но не выше max_quality.
+    Всего выполняется не больше max_trials пробных кодирований, включая
+    первое.
+    """
+    proxy = make_proxy(img, proxy_size)
+    reference = np.asarray(proxy.convert("L"))
+    base_ssim = jpeg_ssim(proxy, reference, quality)
+
+    if base_ssim >= ssim_floor:
+        threshold = max(base_ssim - tolerance, ssim_floor)
+        best, lo, hi = quality, min_quality, quality - 1
+    else:
+        threshold = ssim_floor
+        best, lo, hi = max_quality, quality + 1, max_quality - 1
+
+    trials = 1
+    while lo <= hi and trials < max_trials:
+        mid = (lo + hi) // 2
+        if jpeg_ssim(proxy, reference, mid) >= threshold:
+            best = mid
+            hi = mid - 1
+        else:
+            lo = mid + 1
+        trials += 1
+    return best
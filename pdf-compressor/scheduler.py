@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import redis
+
+
+# Справедливая очередь заданий между сессиями.
+#
+# /compress не отправляет задачу в Celery напрямую, а ставит ее в очередь
+# в Redis с меткой виртуального времени завершения (weighted fair queuing):
+#   start  = max(глобальное виртуальное время, finish предыдущего задания сессии)
+#   finish = start + стоимость задания (оценка числа страниц)
+# В брокер одновременно попадает не больше SCHEDULER_MAX_INFLIGHT заданий,
+# причем каждый раз выбирается задание с наименьшей меткой finish среди
+# сессий, у которых выполняется меньше SESSION_MAX_RUNNING заданий.
+# Так короткие задания интерактивных пользователей не ждут, пока
+# обработаются все большие документы одной сессии.
+#
+# Отправленное задание занимает слот как аренда (lease) со сроком
+# SCHEDULER_LEASE_TIMEOUT, который задача продлевает во время работы.
+# Если аренда истекла, reap() смотрит на состояние задачи в Celery:
+# завершенная задача просто освобождает слот, работающая (STARTED, PROGRESS,
+# RETRY) получает продление, а задание в PENDING (процесс упал до отправки,
+# сообщение потеряно или удалено из брокера) возвращается в очередь.
+# Каждая отправка получает свой токен аренды. Копия задачи, чей токен
+# больше не действителен, узнает об этом из renew() и останавливается,
+# поэтому одно задание не выполняется двумя копиями одновременно.
+
+logger = logging.getLogger(__name__)
+
+# Заданий в брокере и в обработке одновременно (обычно равно числу слотов воркеров)
+SCHEDULER_MAX_INFLIGHT = int(os.getenv('SCHEDULER_MAX_INFLIGHT', 4))
+# Заданий одной сессии в обработке одновременно
+SESSION_MAX_RUNNING = int(os.getenv('SESSION_MAX_RUNNING', 2))
+# Заданий одной сессии, ожидающих в очереди
+SESSION_MAX_QUEUED = int(os.getenv('SESSION_MAX_QUEUED', 10))
+# Срок аренды слота в секундах; задача продлевает его после каждого блока страниц
+SCHEDULER_LEASE_TIMEOUT = int(os.getenv('SCHEDULER_LEASE_TIMEOUT', 600))
+
+KEY_QUEUE = 'fair:queue'          # zset: job_id -> метка finish
+KEY_JOB = 'fair:job:{}'           # задание: сессия, аргументы задачи, метки start и finish
+KEY_FINISH = 'fair:finish'        # hash: session_id -> метка finish последнего задания
+KEY_VTIME = 'fair:vtime'          # глобальное виртуальное время
+KEY_QUEUED = 'fair:queued'        # hash: session_id -> заданий в очереди
+KEY_LEASES = 'fair:leases'        # zset: job_id -> срок аренды (unix time)
+KEY_LEASED = 'fair:leased'        # hash: job_id -> задание с токеном аренды, занимающее слот
+
+# Состояния Celery, после которых задание не нужно отправлять заново
+FINAL_STATES = ('SUCCESS', 'FAILURE')
+
+_redis_client = None
+_redis_lock = threading.Lock()
+
+
+class QuotaExceeded(Exception):
+    """Сессия превысила лимит заданий в очереди"""
+
+
+def get_redis():
+    """Клиент Redis для счетчиков планировщика, создаваемый при первом обращении"""
+    global _redis_client
+    with _redis_lock:
+        if _redis_client is None:
+            _redis_client = redis.Redis(
+                host=os.getenv('REDIS_HOST', 'localhost'),
+                port=int(os.getenv('REDIS_PORT', 6379)),
+                password=os.getenv('REDIS_PASSWORD'),
+                db=int(os.getenv('REDIS_DB', 0))
+            )
+        return _redis_client
+
+
+def _int(value):
+    return int(value) if value is not None else 0
+
+
+def _decr_queued(pipe, session_id, count):
+    """Уменьшение счетчика заданий сессии в очереди внутри MULTI.
+
+    count - текущее значение счетчика; поле удаляется, когда он доходит
+    до нуля, чтобы hash не рос с числом сессий.
+    """
+    if count <= 1:
+        pipe.hdel(KEY_QUEUED, session_id)
+    else:
+        pipe.hincrby(KEY_QUEUED, session_id, -1)
+
+
+def has_capacity(session_id):
+    """Быстрая проверка квоты до загрузки файла; окончательная проверка в enqueue"""
+    return _int(get_redis().hget(KEY_QUEUED, session_id)) < SESSION_MAX_QUEUED
+
+
+def enqueue(session_id, job_id, cost, args):
+    """Постановка задания в справедливую очередь.
+
+    cost - стоимость задания (оценка числа страниц). Бросает QuotaExceeded,
+    если у сессии уже SESSION_MAX_QUEUED ожидающих заданий.
+    """
+    def transaction(pipe):
+        if _int(pipe.hget(KEY_QUEUED, session_id)) >= SESSION_MAX_QUEUED:
+            raise QuotaExceeded(session_id)
+        vtime = float(pipe.get(KEY_VTIME) or 0)
+        last_finish = float(pipe.hget(KEY_FINISH, session_id) or 0)
+        start = max(vtime, last_finish)
+        finish = start + max(cost, 1)
+
+        pipe.multi()
+        pipe.set(KEY_JOB.format(job_id), json.dumps({
+            'id': job_id,
+            'session_id': session_id,
+            'args': args,
+            'start': start,
+            'finish': finish
+        }))
+        pipe.zadd(KEY_QUEUE, {job_id: finish})
+        pipe.hset(KEY_FINISH, session_id, finish)
+        pipe.hincrby(KEY_QUEUED, session_id, 1)
+
+    get_redis().transaction(transaction, KEY_QUEUED, KEY_VTIME, KEY_FINISH)
+
+
+def queue_position(job_id):
+    """Позиция задания в очереди (с нуля) или None, если оно уже отправлено"""
+    return get_redis().zrank(KEY_QUEUE, job_id)
+
+
+def _take_next():
+    """Перевод следующего задания из очереди в аренду; None, если слотов нет"""
+    def transaction(pipe):
+        if pipe.zcard(KEY_LEASES) >= SCHEDULER_MAX_INFLIGHT:
+            return None
+        running = {}
+        for raw in pipe.hvals(KEY_LEASED):
+            session_id = json.loads(raw)['session_id']
+            running[session_id] = running.get(session_id, 0) + 1
+        vtime = float(pipe.get(KEY_VTIME) or 0)
+
+        for job_id in pipe.zrange(KEY_QUEUE, 0, -1):
+            job_id = job_id.decode()
+            raw = pipe.get(KEY_JOB.format(job_id))
+            if raw is None:
+                pipe.multi()
+                pipe.zrem(KEY_QUEUE, job_id)
+                return False
+            job = json.loads(raw)
+            if running.get(job['session_id'], 0) >= SESSION_MAX_RUNNING:
+                continue
+
+            job['lease'] = uuid.uuid4().hex
+            queued = _int(pipe.hget(KEY_QUEUED, job['session_id']))
+            pipe.multi()
+            pipe.zrem(KEY_QUEUE, job_id)
+            pipe.delete(KEY_JOB.format(job_id))
+            _decr_queued(pipe, job['session_id'], queued)
+            pipe.zadd(KEY_LEASES, {job_id: time.time() + SCHEDULER_LEASE_TIMEOUT})
+            pipe.hset(KEY_LEASED, job_id, json.dumps(job))
+            # Задания, отложенные из-за SESSION_MAX_RUNNING, уходят позже
+            # заданий с большей меткой, и время не должно идти назад
+            pipe.set(KEY_VTIME, max(vtime, job['start']))
+            return job
+        return None
+
+    return get_redis().transaction(
+        transaction, KEY_QUEUE, KEY_LEASES, KEY_LEASED, KEY_VTIME, KEY_QUEUED, value_from_callable=True
+    )
+
+
+def dispatch(publish):
+    """Отправка заданий в брокер, пока есть свободные слоты.
+
+    publish(job) отправляет задание; если он падает, задание возвращается
+    в очередь с прежней меткой.
+    """
+    while True:
+        job = _take_next()
+        if job is False:
+            continue
+        if job is None:
+            return
+        try:
+            publish(job)
+        except Exception as e:
+            logger.error(f"Dispatch error: {str(e)}")
+            _requeue(job)
+            return
+
+
+def _requeue(job, expired_only=False):
+    """Возврат арендованного задания в очередь с прежней меткой.
+
+    С expired_only=True ничего не делает, если задача успела продлить аренду.
+    """
+    def transaction(pipe):
+        leased = pipe.hexists(KEY_LEASED, job['id'])
+        deadline = pipe.zscore(KEY_LEASES, job['id'])
+        if expired_only and deadline is not None and deadline > time.time():
+            return
+        pipe.multi()
+        pipe.zrem(KEY_LEASES, job['id'])
+        pipe.hdel(KEY_LEASED, job['id'])
+        if leased:
+            pipe.set(KEY_JOB.format(job['id']), json.dumps(job))
+            pipe.zadd(KEY_QUEUE, {job['id']: job['finish']})
+            pipe.hincrby(KEY_QUEUED, job['session_id'], 1)
+
+    get_redis().transaction(transaction, KEY_LEASED, KEY_LEASES)
+
+
+def _owns_lease(raw, lease):
+    """Аренда в raw выдана отправке с токеном lease (None - любой отправке)"""
+    return raw is not None and (lease is None or json.loads(raw).get('lease') == lease)
+
+
+def renew(job_id, lease=None):
+    """Продление аренды слота.
+
+    Возвращает False, если аренды с токеном lease больше нет: задание
+    вернулось в очередь или отправлено заново, и эта копия задачи
+    должна остановиться.
+    """
+    def transaction(pipe):
+        if not _owns_lease(pipe.hget(KEY_LEASED, job_id), lease):
+            return False
+        pipe.multi()
+        pipe.zadd(KEY_LEASES, {job_id: time.time() + SCHEDULER_LEASE_TIMEOUT})
+        return True
+
+    return get_redis().transaction(transaction, KEY_LEASED, value_from_callable=True)
+
+
+def release(job_id, lease=None):
+    """Освобождение слота после завершения задания.
+
+    С lease слот освобождается, только если аренда принадлежит этой отправке.
+    Если reap() уже вернул задание в очередь, оно оттуда удаляется,
+    чтобы завершенная задача не выполнялась повторно.
+    """
+    def transaction(pipe):
+        leased = pipe.hget(KEY_LEASED, job_id)
+        raw = pipe.get(KEY_JOB.format(job_id))
+        session_id = json.loads(raw)['session_id'] if raw is not None else None
+        queued = _int(pipe.hget(KEY_QUEUED, session_id)) if raw is not None else 0
+        pipe.multi()
+        if _owns_lease(leased, lease):
+            pipe.zrem(KEY_LEASES, job_id)
+            pipe.hdel(KEY_LEASED, job_id)
+        if raw is not None:
+            pipe.zrem(KEY_QUEUE, job_id)
+            pipe.delete(KEY_JOB.format(job_id))
+            _decr_queued(pipe, session_id, queued)
+
+    get_redis().transaction(transaction, KEY_LEASED, KEY_QUEUED, KEY_JOB.format(job_id))
+
+
+def reap(job_state):
+    """Обработка истекших аренд.
+
+    job_state(job_id) возвращает состояние задачи в Celery. Завершенные
+    задания освобождают слот, работающие получают продление аренды, а
+    задания в PENDING возвращаются в очередь и будут отправлены заново.
+    """
+    r = get_redis()
+    for job_id in r.zrangebyscore(KEY_LEASES, '-inf', time.time()):
+        job_id = job_id.decode()
+        raw = r.hget(KEY_LEASED, job_id)
+        state = job_state(job_id) if raw is not None else None
+        if raw is None or state in FINAL_STATES:
+            logger.warning(f"Lease of job {job_id} expired, releasing slot")
+            release(job_id)
+        elif state == 'PENDING':
+            logger.warning(f"Lease of job {job_id} expired, requeueing")
+            _requeue(json.loads(raw), expired_only=True)
+        else:
+            logger.warning(f"Lease of job {job_id} expired in state {state}, renewing")
+            renew(job_id)
+
+
+def prune():
+    """Удаление меток finish, которые не опережают виртуальное время.
+
+    Для такой сессии start нового задания и так равен vtime, поэтому метка
+    не нужна, а без удаления hash растет с каждой новой сессией. Когда
+    очередь пуста, виртуальное время переводится на наибольшую метку finish
+    (как в start-time fair queuing по окончании периода занятости), иначе
+    метки последних заданий остались бы впереди vtime навсегда.
+    """
+    def transaction(pipe):
+        vtime = float(pipe.get(KEY_VTIME) or 0)
+        finish = {session_id: float(tag) for session_id, tag in pipe.hgetall(KEY_FINISH).items()}
+        idle = pipe.zcard(KEY_QUEUE) == 0
+        if idle and finish:
+            vtime = max(vtime, *finish.values())
+        stale = [session_id for session_id, tag in finish.items() if tag <= vtime]
+
+        pipe.multi()
+        if idle:
+            pipe.set(KEY_VTIME, vtime)
+        if stale:
+            pipe.hdel(KEY_FINISH, *stale)
+
+    get_redis().transaction(transaction, KEY_FINISH, KEY_VTIME, KEY_QUEUE)